@@ -14,18 +14,21 @@ class OrganizationAdmin(admin.ModelAdmin):
 @admin.register(Building)
 class BuildingAdmin(admin.ModelAdmin):
     list_display = ['name', 'org']
+    list_select_related = ['org']
     list_filter = ['org']
     search_fields = ['name', 'org__name']
 
 @admin.register(Account)
 class AccountAdmin(admin.ModelAdmin):
     list_display = ['name', 'org']
+    list_select_related = ['org']
     list_filter = ['org']
     search_fields = ['name', 'org__name']
 
 @admin.register(Meter)
 class MeterAdmin(admin.ModelAdmin):
     list_display = ['identifier', 'meter_type', 'building', 'account', 'org', 'is_active', 'unit']
+    list_select_related = ['building__org', 'account__org', 'org']  # Building/Account __str__ read org.name
     list_filter = ['org', 'meter_type']
     search_fields = ['identifier', 'external_id', 'building__name', 'account__name', 'org__name']
     autocomplete_fields = ['building', 'account', 'parent', 'org']
@@ -33,18 +36,30 @@ class MeterAdmin(admin.ModelAdmin):
 @admin.register(VirtualAllocation)
 class VirtualAllocationAdmin(admin.ModelAdmin):
     list_display = ['parent', 'child', 'percent']
+    list_select_related = ['parent', 'child']
     list_filter = ['parent__org']
     search_fields = ['parent__identifier', 'child__identifier']
 
 @admin.register(Formula)
 class FormulaAdmin(admin.ModelAdmin):
     list_display = ['target_meter', 'start', 'end']
+    list_select_related = ['target_meter']
     search_fields = ['target_meter__identifier', 'expression']
     list_filter = ['target_meter__org']
 
 @admin.register(Reading)
 class ReadingAdmin(admin.ModelAdmin):
     list_display = ['meter', 'ts', 'value', 'source', 'classification', 'unit', 'kind']
+    list_select_related = ['meter']
     list_filter = ['meter__org', 'source', 'classification', 'kind', 'unit']
     search_fields = ['meter__identifier']
     date_hierarchy = 'ts'
+    ordering = ['-ts']              # walks the ts index backwards
+    show_full_result_count = False  # skip the unfiltered COUNT(*) on the largest table
+
+    def get_queryset(self, request):
+        # Only load the columns the changelist renders
+        return super().get_queryset(request).only(
+            'id', 'ts', 'value', 'source', 'classification', 'unit', 'kind',
+            'meter', 'meter__identifier', 'meter__meter_type',
+        )
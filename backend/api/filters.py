@@ -0,0 +1,45 @@
+from django_filters import rest_framework as filters
+from .models import Organization, Building, Account, Meter, VirtualAllocation, Reading
+
+"""
+django-filter FilterSets for the UELogic API.
+
+Purpose:
+- Whitelists the query-string filters each viewset accepts: FKs and the columns of the
+  model's indexes (Organization.name, Building/Account (org, name), Meter (org, identifier),
+  external_id and meter_type, Reading (meter, kind, ts)). Second-position columns such as
+  Meter.identifier or Reading.kind are index-backed when sent with their leading column
+  (org / meter), which is how clients query them.
+- Declared once at import time, so DjangoFilterBackend doesn't build a FilterSet class
+  from filterset_fields on every request.
+"""
+
+class OrganizationFilter(filters.FilterSet):
+    class Meta:
+        model = Organization
+        fields = ("name",)
+
+class BuildingFilter(filters.FilterSet):
+    class Meta:
+        model = Building
+        fields = ("org", "name")
+
+class AccountFilter(filters.FilterSet):
+    class Meta:
+        model = Account
+        fields = ("org", "name")
+
+class MeterFilter(filters.FilterSet):
+    class Meta:
+        model = Meter
+        fields = ("org", "building", "account", "identifier", "external_id", "meter_type", "parent")
+
+class VirtualAllocationFilter(filters.FilterSet):
+    class Meta:
+        model = VirtualAllocation
+        fields = ("parent", "child")
+
+class ReadingFilter(filters.FilterSet):
+    class Meta:
+        model = Reading
+        fields = ("meter", "kind", "ts")
@@ -0,0 +1,55 @@
+"""
+Shared CSV helpers for the ingestion commands (load_allocations, load_formulas, load_hierarchy).
+
+The leading underscore keeps Django from registering this module as a command.
+"""
+
+import csv
+
+# Read buffer for CSV files; large sequential reads mean far fewer read() syscalls than the 8 KiB default
+READ_BUFFER_SIZE = 1 << 20
+
+
+def open_csv(path):
+    """Open a CSV for a single streaming pass (BOM-tolerant, csv-module newline handling)."""
+    return open(path, newline="", encoding="utf-8-sig", buffering=READ_BUFFER_SIZE)
+
+
+def build_header_map(headers):
+    """
+    Map normalised (stripped, lowercased) header -> column index.
+    The first occurrence wins, so duplicated headings resolve like list.index().
+    """
+    header_map = {}
+    for i, h in enumerate(headers):
+        header_map.setdefault(h.strip().lower(), i)
+    return header_map
+
+
+def column_index(header_map, candidates):
+    """Return the column index for the first matching alias in `candidates`, else None."""
+    return next((header_map[c] for c in candidates if c in header_map), None)
+
+
+def read_csv(f, delimiter=","):
+    """
+    Read the header row of an open CSV and return (headers, header_map, rows).
+    `rows` lazily yields (record_number, row) for the data rows; the header is record 1.
+    Blank records are skipped (but still counted) and short rows are padded with empty cells,
+    so every index in header_map can be read and .strip()'d directly.
+    headers is None for an empty file.
+    """
+    reader = csv.reader(f, delimiter=delimiter)
+    headers = next(reader, None)
+    if not headers:
+        return None, {}, iter(())
+    return headers, build_header_map(headers), _padded_rows(reader, len(headers))
+
+
+def _padded_rows(reader, width):
+    for i, row in enumerate(reader, start=2):
+        if not row:
+            continue
+        if len(row) < width:
+            row += [""] * (width - len(row))
+        yield i, row
@@ -0,0 +1,83 @@
+import csv
+import io
+from contextlib import contextmanager
+
+from django.core.management.base import CommandError
+from django.db import connection, transaction
+
+"""
+Shared PostgreSQL COPY helpers for the ingestion commands.
+
+Purpose:
+- Streams already-validated rows into a table with COPY ... FROM STDIN, which is
+  several times faster than parameterised INSERTs for large loads.
+- Provides a staged upsert (COPY into a temp table, then INSERT ... SELECT ... ON CONFLICT)
+  for tables with a non-null natural key.
+- Provides load_transaction(), the shared write transaction for bulk loads.
+
+The leading underscore keeps Django from registering this module as a command.
+"""
+
+NULL = r"\N"  # COPY NULL marker; keeps empty strings distinct from NULL
+
+
+def require_postgresql():
+    """Reject --use-copy up front on any other database backend (COPY is PostgreSQL-only)."""
+    if connection.vendor != "postgresql":
+        raise CommandError("--use-copy requires PostgreSQL.")
+
+
+def copy_rows(cursor, table, columns, rows):
+    """
+    COPY rows (iterables of Python values, in `columns` order) into `table`.
+    `cursor` is a Django cursor on a psycopg2 connection. None is written as NULL.
+    """
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    for row in rows:
+        writer.writerow([NULL if v is None else v for v in row])
+    buf.seek(0)
+
+    qn = cursor.db.ops.quote_name
+    cols = ", ".join(qn(c) for c in columns)
+    cursor.copy_expert(f"COPY {qn(table)} ({cols}) FROM STDIN WITH (FORMAT csv, NULL '{NULL}')", buf)
+
+
+def copy_upsert(cursor, table, columns, rows, *, unique_fields, update_fields):
+    """
+    Upsert rows into `table` via an ON COMMIT DROP temp table:
+    COPY into staging, then INSERT ... SELECT ... ON CONFLICT (unique_fields) DO UPDATE.
+    Must run inside a transaction. Rows must be unique on `unique_fields`.
+    """
+    qn = cursor.db.ops.quote_name
+    staging = f"staging_{table}"
+    cols = ", ".join(qn(c) for c in columns)
+
+    # Temp tables are never WAL-logged, so staging costs no extra fsync
+    cursor.execute(
+        f"CREATE TEMP TABLE {qn(staging)} ON COMMIT DROP AS SELECT {cols} FROM {qn(table)} WITH NO DATA"
+    )
+    copy_rows(cursor, staging, columns, rows)
+    cursor.execute(
+        f"INSERT INTO {qn(table)} ({cols}) SELECT {cols} FROM {qn(staging)} "
+        f"ON CONFLICT ({', '.join(qn(c) for c in unique_fields)}) DO UPDATE SET "
+        + ", ".join(f"{qn(c)} = EXCLUDED.{qn(c)}" for c in update_fields)
+    )
+    cursor.execute(f"DROP TABLE {qn(staging)}")
+
+
+@contextmanager
+def load_transaction(dry):
+    """
+    Transaction for a bulk load: one atomic block, with synchronous_commit off on PostgreSQL
+    (don't wait for the WAL flush at commit; a crash can only lose this load).
+    Dry runs write nothing, so no transaction is opened at all.
+    """
+    if dry:
+        yield
+        return
+    with transaction.atomic():
+        if connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                cursor.execute("SET LOCAL synchronous_commit = OFF")
+        yield
@@ -1,11 +1,17 @@
-import csv
 from pathlib import Path
 
 from django.core.management.base import BaseCommand, CommandError
-from django.db import transaction
+from django.db import connection
 
 from api.models import Organization, Meter, VirtualAllocation
+from api.management.commands._csvutils import column_index, open_csv, read_csv
+from api.management.commands._pgcopy import copy_upsert, load_transaction, require_postgresql
 
+# Accepted (lowercased) header aliases per column
+ORG_COLUMNS = ("org", "organization", "organisation")
+PARENT_COLUMNS = ("parent_identifier", "parent id", "parent", "parent_meter")
+CHILD_COLUMNS = ("child_identifier", "child id", "child", "child_meter")
+PERCENT_COLUMNS = ("percent", "allocation", "pct", "percentage")
 
 """
 This management command ingests and applies **virtual meter allocation rules** 
@@ -19,9 +25,6 @@ Purpose:
 - Provides a dry-run mode for testing CSV validity without database changes.
 """
 
-def norm(s):
-    return (s or "").strip()
-
 class Command(BaseCommand):
     help = "Load VirtualAllocation rows from a formulas CSV (parent_identifier, child_identifier, percent)."
 
@@ -29,7 +32,11 @@ class Command(BaseCommand):
         parser.add_argument("csv_path", type=str, help="Path to formulas CSV (e.g., ../../data/formulas.csv)")
         parser.add_argument("--org", type=str, default=None, help="Organization name (if CSV doesn’t include org column)")
         parser.add_argument("--dry-run", action="store_true", help="Parse and report only, no DB writes")
+        parser.add_argument("--check-refs", action="store_true",
+                            help="With --dry-run, also check that orgs and meters exist (otherwise CSV-only checks)")
         parser.add_argument("--delimiter", default=",", help="CSV delimiter (default ,)")
+        parser.add_argument("--use-copy", action="store_true",
+                            help="PostgreSQL only: stage rows with COPY FROM STDIN instead of INSERT (large loads)")
 
     def handle(self, *args, **opts):
         csv_path = Path(opts["csv_path"]).resolve()
@@ -38,112 +45,136 @@ class Command(BaseCommand):
 
         org_name_cli = opts["org"]
         dry = opts["dry_run"]
+        # A plain dry run validates the CSV alone; real loads and --check-refs resolve orgs/meters
+        check_refs = not dry or opts["check_refs"]
         delimiter = opts["delimiter"]
-
-        # Read header using csv.reader (CSV-safe)
-        with csv_path.open(newline="", encoding="utf-8-sig") as f:
-            reader = csv.reader(f, delimiter=delimiter)
-            try:
-                headers = next(reader)
-            except StopIteration:
+        use_copy = opts["use_copy"]
+        if use_copy:
+            require_postgresql()
+
+        # Single pass: the header row is read first, then data rows stream from the same reader.
+        # Columns are addressed by index so duplicated headings resolve to the first one.
+        with open_csv(csv_path) as f:
+            headers, header_map, rows = read_csv(f, delimiter)
+            if not headers:
                 self.stdout.write(self.style.WARNING("Empty CSV"))
                 return
-        headers_lower = [h.strip().lower() for h in headers]
-
-        # Column index helper
-        def idx_of(*candidates):
-            for c in candidates:
-                c_low = c.strip().lower()
-                if c_low in headers_lower:
-                    return headers_lower.index(c_low)
-            return None
-
-        # Detect columns
-        org_idx = idx_of("org", "organization", "organisation")
-        parent_idx = idx_of("parent_identifier", "parent id", "parent", "parent_meter")
-        child_idx = idx_of("child_identifier", "child id", "child", "child_meter")
-        percent_idx = idx_of("percent", "allocation", "pct", "percentage")
-
-        if parent_idx is None or child_idx is None or percent_idx is None:
-            raise CommandError(f"CSV must include parent/child/percent columns. Found: {headers}")
+
+            # Detect columns
+            org_idx = column_index(header_map, ORG_COLUMNS)
+            parent_idx = column_index(header_map, PARENT_COLUMNS)
+            child_idx = column_index(header_map, CHILD_COLUMNS)
+            percent_idx = column_index(header_map, PERCENT_COLUMNS)
+
+            if parent_idx is None or child_idx is None or percent_idx is None:
+                raise CommandError(f"CSV must include parent/child/percent columns. Found: {headers}")
         
-        # If org column not present, require --org and resolve it now
-        org_obj = None
-        if org_idx is None:
-            if not org_name_cli:
-                raise CommandError("No org column in CSV. Provide --org <Organization Name>.")
-            try:
-                org_obj = Organization.objects.get(name=org_name_cli)
-            except Organization.DoesNotExist:
-                raise CommandError(f"Organization not found: {org_name_cli}")
-
-        created = 0
-        updated = 0
-        total = 0
-
-        with csv_path.open(newline="", encoding="utf-8-sig") as f, transaction.atomic():
-            reader = csv.reader(f, delimiter=delimiter)
-            next(reader, None)  # skip header row
-
-            for row in reader:
-                if not row:
-                    continue
-                total += 1
-
-                # Resolve org per row if CSV has an org column
-                row_org_obj = org_obj
-                if org_idx is not None:
-                    org_name = norm(row[org_idx])
+            # If org column not present, require --org and resolve it now
+            org_obj = None
+            if org_idx is None:
+                if not org_name_cli:
+                    raise CommandError("No org column in CSV. Provide --org <Organization Name>.")
+                if check_refs:
                     try:
-                        row_org_obj = Organization.objects.get(name=org_name)
+                        org_obj = Organization.objects.get(name=org_name_cli)
                     except Organization.DoesNotExist:
-                        raise CommandError(f"Row {total}: Organization not found: {org_name}")
-
-                parent_ident = norm(row[parent_idx])
-                child_ident = norm(row[child_idx])
-
-                # Prevent self-allocation
-                if parent_ident == child_ident:
-                    raise CommandError(f"Row {total}: parent and child identifiers are the same ({parent_ident}).")
-
-                # Parse percent (allow a trailing %)
-                pct_raw = norm(row[percent_idx]).rstrip("%")
-                try:
-                    pct = float(pct_raw)
-                except ValueError:
-                    raise CommandError(f"Row {total}: invalid percent value: {row[percent_idx]!r}")
-
-                if pct < 0 or pct > 100:
-                    raise CommandError(f"Row {total}: percent out of range 0–100: {pct}")
-
-                # Look up meters with informative errors
-                try:
-                    parent = Meter.objects.get(org=row_org_obj, identifier=parent_ident)
-                except Meter.DoesNotExist:
-                    raise CommandError(f"Row {total}: parent meter not found (identifier={parent_ident})")
-                except Meter.MultipleObjectsReturned:
-                    raise CommandError(f"Row {total}: multiple parent meters found (identifier={parent_ident})")
-
-                try:
-                    child = Meter.objects.get(org=row_org_obj, identifier=child_ident)
-                except Meter.DoesNotExist:
-                    raise CommandError(f"Row {total}: child meter not found (identifier={child_ident})")
-                except Meter.MultipleObjectsReturned:
-                    raise CommandError(f"Row {total}: multiple child meters found (identifier={child_ident})")
-
-                if dry:
-                    # Validate-only mode—skip DB writes
-                    continue
-                # Upsert by (parent, child)
-                va, created_flag = VirtualAllocation.objects.update_or_create(
-                    parent=parent,
-                    child=child,
-                    defaults={"percent": pct},
-                )
-                if created_flag:
-                    created += 1
+                        raise CommandError(f"Organization not found: {org_name_cli}")
+
+            # Preload orgs and meters once so the row loop is dict lookups instead of per-row queries
+            orgs_by_name, meters, existing = {}, {}, set()
+            if check_refs:
+                if org_idx is not None:
+                    orgs_by_name = {o.name: o for o in Organization.objects.all()}
+                    meter_qs = Meter.objects.all()
+                    alloc_qs = VirtualAllocation.objects.all()
                 else:
-                    updated += 1
+                    orgs_by_name = {org_obj.name: org_obj}
+                    meter_qs = Meter.objects.filter(org=org_obj)
+                    alloc_qs = VirtualAllocation.objects.filter(parent__org=org_obj)
+                # (org_id, identifier) is unique, so each key maps to exactly one meter
+                meters = {(m.org_id, m.identifier): m for m in meter_qs.only("id", "org", "identifier")}
+
+            if not dry:
+                # Existing (parent_id, child_id) pairs, used to classify rows as created/updated
+                existing = set(alloc_qs.values_list("parent_id", "child_id"))
+            allocations = {}  # (parent_id, child_id) -> VirtualAllocation; last row wins like update_or_create
+
+            created = 0
+            updated = 0
+            total = 0
+
+            with load_transaction(dry):
+                for _, row in rows:
+                    total += 1
+
+                    parent_ident = row[parent_idx].strip()
+                    child_ident = row[child_idx].strip()
+
+                    # Prevent self-allocation
+                    if parent_ident == child_ident:
+                        raise CommandError(f"Row {total}: parent and child identifiers are the same ({parent_ident}).")
+
+                    # Parse percent (allow a trailing %)
+                    pct_raw = row[percent_idx].strip().rstrip("%")
+                    try:
+                        pct = float(pct_raw)
+                    except ValueError:
+                        raise CommandError(f"Row {total}: invalid percent value: {row[percent_idx]!r}")
+
+                    if pct < 0 or pct > 100:
+                        raise CommandError(f"Row {total}: percent out of range 0–100: {pct}")
+
+                    if not check_refs:
+                        # CSV-only dry run: no org/meter lookups
+                        continue
+
+                    # Resolve org per row if CSV has an org column
+                    row_org_obj = org_obj
+                    if org_idx is not None:
+                        org_name = row[org_idx].strip()
+                        row_org_obj = orgs_by_name.get(org_name)
+                        if row_org_obj is None:
+                            raise CommandError(f"Row {total}: Organization not found: {org_name}")
+
+                    # Look up meters with informative errors
+                    parent = meters.get((row_org_obj.id, parent_ident))
+                    if parent is None:
+                        raise CommandError(f"Row {total}: parent meter not found (identifier={parent_ident})")
+
+                    child = meters.get((row_org_obj.id, child_ident))
+                    if child is None:
+                        raise CommandError(f"Row {total}: child meter not found (identifier={child_ident})")
+
+                    if dry:
+                        # Validate-only mode—skip DB writes
+                        continue
+                    # Upsert by (parent, child), batched after the loop
+                    key = (parent.id, child.id)
+                    if key in existing:
+                        updated += 1
+                    else:
+                        created += 1
+                        existing.add(key)
+                    allocations[key] = VirtualAllocation(parent=parent, child=child, percent=pct)
+
+                if allocations and use_copy:
+                    with connection.cursor() as cursor:
+                        copy_upsert(
+                            cursor,
+                            VirtualAllocation._meta.db_table,
+                            ["parent_id", "child_id", "percent"],
+                            ((va.parent_id, va.child_id, va.percent) for va in allocations.values()),
+                            unique_fields=["parent_id", "child_id"],
+                            update_fields=["percent"],
+                        )
+                elif allocations:
+                    VirtualAllocation.objects.bulk_create(
+                        allocations.values(),
+                        batch_size=1000,
+                        update_conflicts=True,
+                        unique_fields=["parent", "child"],
+                        update_fields=["percent"],
+                    )
 
         self.stdout.write(self.style.SUCCESS(
             f"Processed {total} rows. Created: {created}, Updated: {updated}."
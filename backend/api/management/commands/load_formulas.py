@@ -1,13 +1,38 @@
-import csv
+import sys
+from collections import defaultdict
+from functools import lru_cache
 from pathlib import Path
 
-from django.db import models, transaction
+from django.db import connection, models
 from django.core.management.base import BaseCommand, CommandError
-from django.utils import timezone
 from django.utils.dateparse import parse_datetime
 
 from api.models import Organization, Building, Meter, Formula
-from datetime import timezone as dt_timezone
+from api.management.commands._csvutils import column_index, open_csv, read_csv
+from api.management.commands._pgcopy import copy_rows, load_transaction, require_postgresql
+from datetime import datetime, timezone as dt_timezone
+
+_UTC = dt_timezone.utc
+
+# Default rows per INSERT/UPDATE statement (keeps well under Postgres' bind-parameter limit)
+BATCH_SIZE = 1000
+
+# Accepted (lowercased) header aliases per column
+ORG_COLUMNS = ("org", "organization", "organisation")
+SITE_COLUMNS = ("site", "sitename", "building", "site name")
+KIND_COLUMNS = ("meterkind", "kind")
+TARGET_COLUMNS = ("target_identifier", "target", "meter", "identifier")
+SERIAL_COLUMNS = ("meter_serial_number", "meterserialnumber", "serial", "serialno")
+MPX_COLUMNS = ("meterpointreferenceid", "mpan", "mprn", "meter point reference id")
+EXPR_COLUMNS = ("expression", "expr", "formula")
+START_COLUMNS = ("start", "start_utc", "startutc", "begin", "valid_from")
+END_COLUMNS = ("end", "end_utc", "endutc", "valid_to", "stop")
+
+# MeterKind values that carry formulas -> the meter type they must resolve to
+KIND_TO_METER_TYPE = {
+    "virtual": Meter.MeterType.VIRTUAL,
+    "sub": Meter.MeterType.SUB,
+}
 
 """
 This management command ingests and applies **formula definitions** for virtual meters into the database.
@@ -19,8 +44,32 @@ Purpose:
 - Provides validation for syntax and references to existing meters.
 """
 
-def norm(s):
-    return (s or "").strip()
+
+@lru_cache(maxsize=4096)
+def _parse_utc_cached(raw):
+    """
+    Parse a stripped, non-empty ISO8601 string to an aware UTC datetime, or None if unparseable.
+    Cached because formula CSVs repeat the same window boundaries on many rows.
+    """
+    try:
+        # C-implemented fast path; on Python 3.11+ it accepts 'Z' and the common ISO8601 forms
+        dt = datetime.fromisoformat(raw)
+    except ValueError:
+        # Normalise trailing 'Z' (UTC) so parse_datetime sees timezone
+        if raw.endswith("Z"):
+            raw = raw[:-1] + "+00:00"
+
+        dt = parse_datetime(raw)
+        if dt is None:
+            return None
+
+    # Naive values are UTC; attach the fixed UTC tzinfo directly (no zone lookup needed)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=_UTC)
+    else:
+        dt = dt.astimezone(_UTC)
+
+    return dt
 
 
 def parse_utc(dt_str, row_num):
@@ -28,97 +77,112 @@ def parse_utc(dt_str, row_num):
     Accepts common ISO8601 formats (e.g., 2025-07-01T00:00:00Z, 2025-07-01 00:00:00, etc.)
     Returns timezone-aware UTC datetimes. Raises CommandError on failure.
     """
-    raw = norm(dt_str)
+    raw = dt_str.strip()
     if not raw:
         return None
-    
-    # Normalise trailing 'Z' (UTC) so parse_datetime sees timezone
-    if raw.endswith("Z"):
-        raw = raw[:-1] + "+00:00"
 
-    dt = parse_datetime(raw)
+    dt = _parse_utc_cached(raw)
     if dt is None:
         raise CommandError(f"Row {row_num}: could not parse datetime: {dt_str!r}")
-
-    if timezone.is_naive(dt):
-        dt = timezone.make_aware(dt, dt_timezone.utc)
-    else:
-        dt = dt.astimezone(dt_timezone.utc)
-
     return dt
 
 
-def resolve_target_meter(*, site_name, serial, mpx, ident, strict_site, expected_type=None):
+def build_meter_index(meter_types=None):
+    """
+    Preload meters once (optionally only `meter_types`) so target resolution is dict lookups
+    instead of per-row queries. Returns {"identifier": {value: [Meter, ...]}, "external_id": {value: [Meter, ...]},
+    "site_ids": {building_name: {building_id, ...}}}. Values are lists so ambiguity can still be reported.
+    """
+    index = {
+        "identifier": defaultdict(list),
+        "external_id": defaultdict(list),
+        "site_ids": defaultdict(set),  # building names are only unique per org
+    }
+    for bld_id, bld_name in Building.objects.values_list("id", "name"):
+        index["site_ids"][bld_name].add(bld_id)
+    meters = Meter.objects.only("id", "identifier", "external_id", "meter_type", "building")
+    if meter_types:
+        meters = meters.filter(meter_type__in=meter_types)
+    for m in meters.iterator():
+        index["identifier"][m.identifier].append(m)
+        if m.external_id:
+            index["external_id"][m.external_id].append(m)
+    return index
+
+
+def resolve_target_meter(*, meter_index, site_name, serial, mpx, ident, strict_site, expected_type=None):
     """
     Returns (meter, via). Priority: MPxN -> Serial -> Identifier.
     MPxN is matched against BOTH identifier and external_id for robustness.
     Optionally filter by expected_type (Meter.MeterType.SUB / VIRTUAL) to reduce ambiguity.
+    Lookups run against the preloaded meter_index from build_meter_index().
     """
-    from api.models import Meter
-    from django.core.management.base import CommandError
-
-    base = Meter.objects.all()
-    if expected_type:
-        base = base.filter(meter_type=expected_type) 
-
-    # normalise
-    serial    = norm(serial) or None
-    mpx       = norm(mpx) or None
-    ident     = norm(ident) or None
-    site_name = norm(site_name) or None
+    def candidates(field, value):
+        found = meter_index[field].get(value, ())
+        if expected_type:
+            found = [m for m in found if m.meter_type == expected_type]
+        return found
+
+    def at_site(found):
+        return [m for m in found if m.building_id in site_ids]
+
+    # callers pass already-stripped fields; just fold "" to None
+    serial    = serial or None
+    mpx       = mpx or None
+    ident     = ident or None
+    site_name = site_name or None
+    site_ids  = meter_index["site_ids"].get(site_name, ())
 
     # 1. MPxN FIRST: check identifier then external_id
     if mpx:
         # a) identifier = MPxN
-        q = base.filter(identifier=mpx)
+        q = candidates("identifier", mpx)
         if site_name:
-            q_site = q.filter(building__name=site_name)
-            if q_site.count() == 1:
-                return q_site.get(), f"mpx(identifier)={mpx!r} @ {site_name}"
+            q_site = at_site(q)
+            if len(q_site) == 1:
+                return q_site[0], f"mpx(identifier)={mpx!r} @ {site_name}"
             if strict_site:
                 raise CommandError(f"MPxN {mpx!r} not unique/found at site={site_name!r} (identifier).")
-        if q.count() == 1:
-            return q.get(), f"mpx(identifier)={mpx!r}"
-        if q.count() > 1:
+        if len(q) == 1:
+            return q[0], f"mpx(identifier)={mpx!r}"
+        if len(q) > 1:
             raise CommandError(f"MPxN {mpx!r} ambiguous across meters (identifier); add SiteName.")
 
         # b) external_id = MPxN
-        q = base.filter(external_id=mpx)
+        q = candidates("external_id", mpx)
         if site_name:
-            q_site = q.filter(building__name=site_name)
-            if q_site.count() == 1:
-                return q_site.get(), f"mpx(external_id)={mpx!r} @ {site_name}"
+            q_site = at_site(q)
+            if len(q_site) == 1:
+                return q_site[0], f"mpx(external_id)={mpx!r} @ {site_name}"
             if strict_site:
                 raise CommandError(f"MPxN {mpx!r} not unique/found at site={site_name!r} (external_id).")
-        if q.count() == 1:
-            return q.get(), f"mpx(external_id)={mpx!r}"
-        if q.count() > 1:
+        if len(q) == 1:
+            return q[0], f"mpx(external_id)={mpx!r}"
+        if len(q) > 1:
             raise CommandError(f"MPxN {mpx!r} ambiguous across meters (external_id); add SiteName.")
 
     # 2. SERIAL next: external_id = serial
     if serial:
-        q = base.filter(external_id=serial)
+        q = candidates("external_id", serial)
         if site_name:
-            q_site = q.filter(building__name=site_name)
-            if q_site.count() == 1:
-                return q_site.get(), f"serial={serial!r} @ {site_name}"
+            q_site = at_site(q)
+            if len(q_site) == 1:
+                return q_site[0], f"serial={serial!r} @ {site_name}"
             if strict_site:
                 raise CommandError(f"Serial {serial!r} not unique/found at site={site_name!r}.")
-        if q.count() == 1:
-            return q.get(), f"serial={serial!r}"
-        if q.count() > 1:
+        if len(q) == 1:
+            return q[0], f"serial={serial!r}"
+        if len(q) > 1:
             raise CommandError(f"Serial {serial!r} ambiguous; add SiteName.")
 
     # 3. IDENTIFIER last
     if ident:
-        q = base.filter(identifier=ident)
+        q = candidates("identifier", ident)
         if site_name:
-            q = q.filter(building__name=site_name)
-        try:
-            return q.get(), f"identifier={ident!r}{' @ '+site_name if site_name else ''}"
-        except Meter.DoesNotExist:
-            pass
-        except Meter.MultipleObjectsReturned:
+            q = at_site(q)
+        if len(q) == 1:
+            return q[0], f"identifier={ident!r}{' @ '+site_name if site_name else ''}"
+        if len(q) > 1:
             raise CommandError(f"Identifier {ident!r} ambiguous; add SiteName.")
 
     raise CommandError("Could not uniquely resolve a meter via MPxN/serial/identifier.")
@@ -134,12 +198,18 @@ class Command(BaseCommand):
         parser.add_argument("csv_path", type=str, help="Path to CSV file.")
         parser.add_argument("--org", type=str, default=None, help="Organization name (used only if CSV lacks an org column;if both are present, CSV value takes precedence)")
         parser.add_argument("--dry-run", action="store_true", help="Validate only; no DB write")
+        parser.add_argument("--check-refs", action="store_true",
+            help="With --dry-run, also resolve target meters (otherwise CSV-only checks)")
         parser.add_argument("--delimiter", default=",", help="CSV delimiter (default ,)")
         parser.add_argument(
             "--replace",
             action="store_true",
             help="Delete and re-insert formulas where organization, target identifier, start_utc, and end_utc match existing records."
         )
+        parser.add_argument("--batch-size", type=int, default=BATCH_SIZE,
+            help=f"Rows per INSERT/UPDATE/DELETE statement (default {BATCH_SIZE})")
+        parser.add_argument("--use-copy", action="store_true",
+            help="PostgreSQL only: insert new formulas with COPY FROM STDIN instead of INSERT (large loads, --replace)")
 
 
     def handle(self, *args, **opts):
@@ -150,129 +220,164 @@ class Command(BaseCommand):
         strict_site = opts["strict_site"]
         org_name_cli = opts["org"]
         dry = opts["dry_run"]
+        # A plain dry run validates the CSV alone; real loads and --check-refs resolve meters
+        check_refs = not dry or opts["check_refs"]
         delimiter = opts["delimiter"]
         replace = opts["replace"]
-
-        # Read header safely
-        with csv_path.open(newline="", encoding="utf-8-sig") as f:
-            reader = csv.reader(f, delimiter=delimiter)
-            try:
-                headers = next(reader)
-            except StopIteration:
+        use_copy = opts["use_copy"]
+        batch_size = opts["batch_size"]
+        if batch_size < 1:
+            raise CommandError("--batch-size must be a positive integer.")
+        if use_copy:
+            require_postgresql()
+
+        # Single pass: the header row is read first, then data rows stream from the same reader.
+        # Columns are addressed by index so duplicated headings resolve to the first one.
+        with open_csv(csv_path) as f:
+            headers, header_map, rows = read_csv(f, delimiter)
+            if not headers:
                 self.stdout.write(self.style.WARNING("Empty CSV"))
                 return
-        headers_lower = [h.strip().lower() for h in headers]
 
-        def idx_of(*cands):
-            for c in cands:
-                c_low = c.strip().lower()
-                if c_low in headers_lower:
-                    return headers_lower.index(c_low)
-            return None
-        
-        # Explected flixible columns
-        org_idx = idx_of("org", "organization", "organisation")
-        site_idx = idx_of("site", "sitename", "building", "site name")
-        kind_idx   = idx_of("meterkind", "kind")                          # required to identify Virtual/Sub
-        target_idx = idx_of("target_identifier", "target", "meter", "identifier")
-        serial_idx = idx_of("meter_serial_number", "meterserialnumber", "serial", "serialno")
-        mpx_idx    = idx_of("meterpointreferenceid", "mpan", "mprn", "meter point reference id")
-        expr_idx = idx_of("expression", "expr", "formula")    
-        start_idx = idx_of("start", "start_utc", "startutc", "begin", "valid_from")
-        end_idx = idx_of("end", "end_utc", "endutc", "valid_to", "stop")
-
-        required_missing = []
-        if expr_idx is None:  required_missing.append("expression/formula")
-        if start_idx is None: required_missing.append("start/start_utc")
-        # at least one identifier: serial OR MPxN OR internal identifier
-        if serial_idx is None and mpx_idx is None and target_idx is None:
-            required_missing.append("one of: MeterSerialNumber / MPAN|MPRN / identifier")
-        # kind_idx is OPTIONAL now
-        if required_missing:
-            raise CommandError(f"CSV missing required column(s): {', '.join(required_missing)}. Found: {headers}")
-
-
-
-        # Resolve org per row (if provided), else via --org, else error
-        default_org = None
-        if org_idx is None and org_name_cli:
-            try:
-                default_org = Organization.objects.get(name=org_name_cli)
-            except Organization.DoesNotExist:
-                raise CommandError(f"Organization not found: {org_name_cli}")
+            # Expected flexible columns
+            org_idx    = column_index(header_map, ORG_COLUMNS)
+            site_idx   = column_index(header_map, SITE_COLUMNS)
+            kind_idx   = column_index(header_map, KIND_COLUMNS)    # required to identify Virtual/Sub
+            target_idx = column_index(header_map, TARGET_COLUMNS)
+            serial_idx = column_index(header_map, SERIAL_COLUMNS)
+            mpx_idx    = column_index(header_map, MPX_COLUMNS)
+            expr_idx   = column_index(header_map, EXPR_COLUMNS)
+            start_idx  = column_index(header_map, START_COLUMNS)
+            end_idx    = column_index(header_map, END_COLUMNS)
+
+            required_missing = []
+            if expr_idx is None:  required_missing.append("expression/formula")
+            if start_idx is None: required_missing.append("start/start_utc")
+            # at least one identifier: serial OR MPxN OR internal identifier
+            if serial_idx is None and mpx_idx is None and target_idx is None:
+                required_missing.append("one of: MeterSerialNumber / MPAN|MPRN / identifier")
+            # kind_idx is OPTIONAL now
+            if required_missing:
+                raise CommandError(f"CSV missing required column(s): {', '.join(required_missing)}. Found: {headers}")
+
+
+
+            # Resolve org per row (if provided), else via --org, else error
+            default_org = None
+            if org_idx is None and org_name_cli and check_refs:
+                try:
+                    default_org = Organization.objects.get(name=org_name_cli)
+                except Organization.DoesNotExist:
+                    raise CommandError(f"Organization not found: {org_name_cli}")
             
-        # initialize counters for reporting
-        created = 0
-        updated = 0
-        total = 0
+            # Preload meters for target resolution
+            # Rows only ever target sub or virtual meters, so fiscal meters are not loaded
+            meter_index = build_meter_index(
+                meter_types=[Meter.MeterType.SUB, Meter.MeterType.VIRTUAL]
+            ) if check_refs else None
+
+            # Existing formulas by natural key. `end` may be NULL, which Postgres never treats as a
+            # conflict, so existing rows are matched here rather than via ON CONFLICT.
+            existing = {}
+            if not dry:
+                existing = {
+                    (target_id, start, end): pk
+                    for pk, target_id, start, end in Formula.objects.values_list("id", "target_meter_id", "start", "end")
+                }
+            formulas = {}  # (target_meter_id, start, end) -> Formula; last row wins like update_or_create
+
+            # initialize counters for reporting
+            created = 0
+            updated = 0
+            total = 0
             
-        with csv_path.open(newline="", encoding="utf-8-sig") as f, transaction.atomic():
-            reader = csv.reader(f, delimiter=delimiter)
-            next(reader, None)  # skip header
-
-            for i, row in enumerate(reader, start=2):
-                if not row:
-                    continue
-                total += 1
-
-                # Site (optional)
-                site_name = norm(row[site_idx]) or None if site_idx is not None else None
-
-                # Meter kind (CSV overrides; default to 'sub' if not provided)
-                kind = (norm(row[kind_idx]) if kind_idx is not None else "sub").lower()
-                if kind not in {"virtual", "sub"}:
-                    # skip fiscal/others
-                    continue
-
-                expected_type = Meter.MeterType.VIRTUAL if kind == "virtual" else Meter.MeterType.SUB
-
-
-                # Expression + time window
-                expression = row[expr_idx]
-                start_dt = parse_utc(row[start_idx], i)
-                end_dt = parse_utc(row[end_idx], i) if end_idx is not None else None
-                if end_dt is not None and start_dt >= end_dt:
-                    raise CommandError(f"Row {i}: start must be < end (got start={start_dt}, end={end_dt}).")
-
-                # Numbers-first resolution inputs
-                serial = norm(row[serial_idx]) if serial_idx is not None else None
-                mpx    = norm(row[mpx_idx])    if mpx_idx    is not None else None
-                ident  = norm(row[target_idx]) if target_idx is not None else None
-
-                # Resolve target meter by serial -> MPxN -> identifier
-                try:
-                    target, via = resolve_target_meter(
-                        site_name=site_name,
-                        serial=serial,
-                        mpx=mpx,
-                        ident=ident,
-                        strict_site=strict_site,
-                        expected_type=expected_type
-                        )
-                except CommandError as e:
-                    raise CommandError(f"Row {i}: {e}")
-
-                # Enforce intended type
-                expected_type = Meter.MeterType.VIRTUAL if kind == "virtual" else Meter.MeterType.SUB
-                if target.meter_type != expected_type:
-                    raise CommandError(
-                        f"Row {i}: MeterKind={kind} but resolved meter is {target.meter_type} (via {via})."
+            with load_transaction(dry):
+                # i is the 1-based CSV record number (header = 1), so errors point at the right record
+                for i, row in rows:
+                    total += 1
+
+                    # Site (optional)
+                    site_name = (row[site_idx].strip() or None) if site_idx is not None else None
+
+                    # Meter kind (CSV overrides; default to 'sub' if not provided)
+                    kind = row[kind_idx].strip().lower() if kind_idx is not None else "sub"
+                    expected_type = KIND_TO_METER_TYPE.get(kind)
+                    if expected_type is None:
+                        # skip fiscal/others
+                        continue
+
+                    # Expression + time window
+                    # Many meters share the same formula text; intern so buffered rows share one string
+                    expression = sys.intern(row[expr_idx])
+                    start_dt = parse_utc(row[start_idx], i)
+                    end_dt = parse_utc(row[end_idx], i) if end_idx is not None else None
+                    if end_dt is not None and start_dt >= end_dt:
+                        raise CommandError(f"Row {i}: start must be < end (got start={start_dt}, end={end_dt}).")
+
+                    if not check_refs:
+                        # CSV-only dry run: no meter resolution
+                        continue
+
+                    # Numbers-first resolution inputs
+                    serial = row[serial_idx].strip() if serial_idx is not None else None
+                    mpx    = row[mpx_idx].strip()    if mpx_idx    is not None else None
+                    ident  = row[target_idx].strip() if target_idx is not None else None
+
+                    # Resolve target meter by serial -> MPxN -> identifier. Only meters of the intended
+                    # type are candidates, so a resolved target always matches MeterKind.
+                    try:
+                        target, _ = resolve_target_meter(
+                            meter_index=meter_index,
+                            site_name=site_name,
+                            serial=serial,
+                            mpx=mpx,
+                            ident=ident,
+                            strict_site=strict_site,
+                            expected_type=expected_type
+                            )
+                    except CommandError as e:
+                        raise CommandError(f"Row {i}: {e}")
+
+                    if dry:
+                        continue
+
+                    # Upsert by (target_meter, start, end), batched after the loop
+                    key = (target.id, start_dt, end_dt)
+                    if key in existing or key in formulas:
+                        updated += 1
+                    else:
+                        created += 1
+                    formulas[key] = Formula(
+                        id=None if replace else existing.get(key),
+                        target_meter=target,
+                        start=start_dt,
+                        end=end_dt,
+                        expression=expression,
                     )
 
-                if dry:
-                    continue
-
-                # Upsert by (target_meter, start, end)
-                obj, created_flag = Formula.objects.update_or_create(
-                    target_meter=target,
-                    start=start_dt,
-                    end=end_dt,
-                    defaults={"expression": expression},
-                )
-                if created_flag:
-                    created += 1
+                if replace:
+                    # Delete matching rows, then re-insert everything as new
+                    matched = [existing[k] for k in formulas if k in existing]
+                    for n in range(0, len(matched), batch_size):
+                        Formula.objects.filter(id__in=matched[n:n + batch_size]).delete()
+                    to_create = list(formulas.values())
+                    to_update = []
+                else:
+                    to_create = [f for f in formulas.values() if f.id is None]
+                    to_update = [f for f in formulas.values() if f.id is not None]
+
+                if use_copy and to_create:
+                    # New keys only (matched rows were split out or deleted), so no conflict handling needed
+                    with connection.cursor() as cursor:
+                        copy_rows(
+                            cursor,
+                            Formula._meta.db_table,
+                            ["target_meter_id", "start", "end", "expression"],
+                            ((f.target_meter_id, f.start, f.end, f.expression) for f in to_create),
+                        )
                 else:
-                    updated += 1
+                    Formula.objects.bulk_create(to_create, batch_size=batch_size)
+                Formula.objects.bulk_update(to_update, ["expression"], batch_size=batch_size)
 
         # Summary
         self.stdout.write(self.style.SUCCESS(
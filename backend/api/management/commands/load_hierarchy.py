@@ -1,11 +1,12 @@
-import csv
-from collections import defaultdict
+import sys
 from pathlib import Path
 
 from django.core.management.base import BaseCommand, CommandError
-from django.db import transaction
+from django.db import connection
 
 from api.models import Organization, Building, Account, Meter
+from api.management.commands._csvutils import open_csv, read_csv
+from api.management.commands._pgcopy import copy_rows, load_transaction, require_postgresql
 
 
 """
@@ -20,8 +21,28 @@ Purpose:
 """
 
 
-def norm(s):
-    return (s or "").strip()
+# Rows per INSERT/UPDATE statement when bulk-writing meters
+BATCH_SIZE = 1000
+
+# is_active values read as true; a blank or missing column defaults to active
+TRUTHY = frozenset({"1", "true", "yes", "y"})
+
+# Column aliases to be flexible with headings (lowercase; headers are lowercased before lookup)
+ALIASES = {
+    "organization": frozenset({"org", "organization", "organisation", "business name"}),
+    "building": frozenset({"building", "site", "sitename"}),
+    "account": frozenset({"account", "tenant", "cost_center", "cost centre", "suite"}),
+    "identifier": frozenset({"identifier", "meter_identifier", "meter point", "meterpointreferenceid", "meter id", "meter", "meter_ref"}),
+    "external_id": frozenset({"external_id", "external id", "source_id", "meter serial", "meterserialnumber"}),
+    "meter_type": frozenset({"meter_type", "type", "meterkind", "expected data source"}),  # we'll infer if needed
+    "parent_identifier": frozenset({"parent_identifier", "parent id", "parent"}),          # plus: we’ll also read “Child 1..4” as children->parents
+    "unit": frozenset({"unit", "uom"}),                                                    # will use default if missing
+    "is_active": frozenset({"is_active", "active", "enabled", "registration status"}),
+}
+
+# Normalised alias -> canonical column key, so each header resolves with one dict lookup
+ALIAS_TO_KEY = {alias: key for key, names in ALIASES.items() for alias in names}
+
 
 class Command(BaseCommand):
     help = "Load Organizations, Buildings, Accounts, and Meters from a hierarchy CSV."
@@ -33,6 +54,8 @@ class Command(BaseCommand):
         parser.add_argument("--default-unit", default="kWh", help="Unit to use when CSV lacks a unit column/value")
         parser.add_argument("--default-meter-type", default="sub", choices=["fiscal","sub","virtual"],
                             help="Meter type to use when CSV lacks/unknown meter_type")
+        parser.add_argument("--use-copy", action="store_true",
+                            help="PostgreSQL only: insert new meters with COPY FROM STDIN instead of INSERT (large loads)")
 
     def handle(self, *args, **options):
         csv_path = Path(options["csv_path"])
@@ -41,162 +64,164 @@ class Command(BaseCommand):
 
         dry_run = options["dry_run"]
         delimiter = options["delimiter"]
+        use_copy = options["use_copy"]
+        if use_copy:
+            require_postgresql()
 
         
-        # Column aliases to be flexible with headings
-        aliases = {
-        "organization": {"org", "organization", "organisation", "business name"},
-        "building": {"building", "site", "sitename"},
-        "account": {"account", "tenant", "cost_center", "cost centre", "suite"},
-        "identifier": {"identifier", "meter_identifier", "meter point", "meterpointreferenceid", "meter id", "meter", "meter_ref"},
-        "external_id": {"external_id", "external id", "source_id", "meter serial", "meterserialnumber"},
-        "meter_type": {"meter_type", "type", "meterkind", "expected data source"},  # we'll infer if needed
-        "parent_identifier": {"parent_identifier", "parent id", "parent"},          # plus: we’ll also read “Child 1..4” as children->parents
-        "unit": {"unit", "uom"},                                                    # will use default if missing
-        "is_active": {"is_active", "active", "enabled", "registration status"},
-    }
-
-        def resolve_key(header_to_idx, key):
-            for alias in aliases[key]:
-                for h in header_to_idx:
-                    if h.lower().strip() == alias:
-                        return h
-            return None
+        # One transaction for the whole load (one commit instead of one per org/building/account)
+        with load_transaction(dry_run):
+            # Stream the CSV: rows are handled as they are read rather than materialised with list(reader)
+            with open_csv(csv_path) as f:
+                header_row, _, rows = read_csv(f, delimiter)
+
+                if header_row is None:
+                    self.stdout.write(self.style.WARNING("Empty CSV"))
+                    return
+
+                headers = [h.strip() for h in header_row]
+
+                # Map each column key to the index of its first matching header
+                col = dict.fromkeys(ALIASES)
+                for i, h in enumerate(headers):
+                    key = ALIAS_TO_KEY.get(h.lower())
+                    if key and col[key] is None:
+                        col[key] = i
+                required = ["organization", "building", "identifier", "meter_type", "unit"]
+                missing = [k for k in required if col[k] is None]
+                if missing:
+                    raise CommandError(f"Missing required column(s): {', '.join(missing)}. Found headers: {headers}")
+
+                # Column indices as locals so the row loop does plain list indexing
+                i_org, i_bld, i_acct = col["organization"], col["building"], col["account"]
+                i_ident, i_ext, i_type = col["identifier"], col["external_id"], col["meter_type"]
+                i_parent, i_unit, i_active = col["parent_identifier"], col["unit"], col["is_active"]
         
-        
-        # Read CSV
-        with csv_path.open(newline="", encoding="utf-8-sig") as f:
-            reader = csv.reader(f, delimiter=delimiter)
-            rows = list(reader)
-
-        if not rows:
-            self.stdout.write(self.style.WARNING("Empty CSV"))
-            return
-
-        headers = [h.strip() for h in rows[0]]
-        header_to_idx = {h: i for i, h in enumerate(headers)}
-
-        # Map column names found
-        col = {k: resolve_key(header_to_idx, k) for k in aliases}
-        required = ["organization", "building", "identifier", "meter_type", "unit"]
-        missing = [k for k in required if not col[k]]
-        if missing:
-            raise CommandError(f"Missing required column(s): {', '.join(missing)}. Found headers: {headers}")
-        
-        # Caches to avoid repeated DB lookups
-        org_cache = {}
-        bld_cache = defaultdict(dict)   # org_id -> {building_name: Building}
-        acct_cache = defaultdict(dict)  # org_id -> {account_name: Account}
-        meter_buffer = []               # collect first pass
-        parent_links = []               # (org_obj, child_meter_identifier, parent_identifier)
+                # Names seen in the CSV; resolved against the DB in bulk once the file has been read
+                org_names = set()
+                bld_keys = set()                # (org_name, building_name)
+                acct_keys = set()               # (org_name, account_name)
+                meter_buffer = []               # collect first pass as tuples (org_name, bld_name, acct_name, identifier, external_id, meter_type, unit, is_active)
+                parent_links = {}               # (org_name, child_meter_identifier) -> parent_identifier; duplicate rows collapse, last wins
 
-        created_counts = dict(org=0, building=0, account=0, meter=0)
-        row_count = 0
-
-        
-        # First pass: create organization/building/account, buffer meters (parent may not exist yet)
-        for r in rows[1:]:
-            if not any(r):  # skip completely empty lines
-                continue
-            row_count += 1
-
-            org_name = norm(r[header_to_idx[col["organization"]]])
-            bld_name = norm(r[header_to_idx[col["building"]]])
-            acct_name = norm(r[header_to_idx[col["account"]]]) if col["account"] else ""
-            identifier = norm(r[header_to_idx[col["identifier"]]])
-            external_id = norm(r[header_to_idx[col["external_id"]]]) if col["external_id"] else ""
-            meter_type = norm(r[header_to_idx[col["meter_type"]]]).lower()
-            parent_identifier = norm(r[header_to_idx[col["parent_identifier"]]]) if col["parent_identifier"] else ""
-            unit = norm(r[header_to_idx[col["unit"]]])
-            is_active_raw = norm(r[header_to_idx[col["is_active"]]]) if col["is_active"] else "true"
-            is_active = (is_active_raw or "true").lower() in {"1", "true", "yes", "y"}
-
-            # get/create org
-            org_obj = org_cache.get(org_name)
-            if not org_obj and not dry_run:
-                org_obj, created = Organization.objects.get_or_create(name=org_name)
-                org_cache[org_name] = org_obj
-                if created:
-                    created_counts["org"] += 1
-
-            # get/create building
-            bld_obj = None
-            if org_obj:
-                bld_obj = bld_cache[org_obj.id].get(bld_name)
-                if not bld_obj and not dry_run:
-                    bld_obj, created = Building.objects.get_or_create(org=org_obj, name=bld_name)
-                    bld_cache[org_obj.id][bld_name] = bld_obj
-                    if created:
-                        created_counts["building"] += 1
-
-            # get/create account
-            acct_obj = None
-            if acct_name and org_obj and not dry_run:
-                acct_obj = acct_cache[org_obj.id].get(acct_name)
-                if not acct_obj:
-                    acct_obj, created = Account.objects.get_or_create(org=org_obj, name=acct_name)
-                    acct_cache[org_obj.id][acct_name] = acct_obj
-                    if created:
-                        created_counts["account"] += 1
-
-            # buffer meter (create in second pass so parents can be resolved)
-            meter_buffer.append({
-                "org_name": org_name,
-                "org_obj": org_obj,
-                "building_name": bld_name,
-                "building_obj": bld_obj,
-                "account_name": acct_name,
-                "account_obj": acct_obj,
-                "identifier": identifier,
-                "external_id": external_id or None,
-                "meter_type": meter_type,
-                "parent_identifier": parent_identifier or None,
-                "unit": unit,
-                "is_active": is_active,
-            })
-
-            if parent_identifier:
-                parent_links.append((org_obj, identifier, parent_identifier))
+                created_counts = dict(org=0, building=0, account=0, meter=0)
+                row_count = 0
 
         
-        # Second pass: create meters, then wire parents
-        with transaction.atomic():
-            # create meters
-            for m in meter_buffer:
-                if dry_run:
-                    continue
-                org_obj = m["org_obj"]
-                if not org_obj:
-                    raise CommandError(f"Row with missing org could not be created (identifier={m['identifier']}).")
-
-                # Ensure building exists (safety if bld_obj was None in pass 1 due to dry-run toggling)
-                bld_obj = m["building_obj"] or Building.objects.get(org=org_obj, name=m["building_name"])
-                acct_obj = m["account_obj"]
-
-                meter, created = Meter.objects.get_or_create(
-                    org=org_obj,
-                    identifier=m["identifier"],
-                    defaults=dict(
-                        building=bld_obj,
-                        account=acct_obj,
-                        external_id=m["external_id"],
-                        meter_type=m["meter_type"],
-                        unit=m["unit"],
-                        is_active=m["is_active"],
-                    ),
-                )
-                if created:
-                    created_counts["meter"] += 1
-
-            # wire parents
-            for org_obj, child_ident, parent_ident in parent_links:
-                if dry_run:
-                    continue
-                child = Meter.objects.get(org=org_obj, identifier=child_ident)
-                parent = Meter.objects.get(org=org_obj, identifier=parent_ident)
-                if child.parent_id != parent.id:
-                    child.parent = parent
-                    child.save(update_fields=["parent"])
+                # First pass: collect organization/building/account names, buffer meters (parent may not exist yet)
+                for _, r in rows:
+                    if not any(r):  # skip completely empty lines
+                        continue
+                    row_count += 1
+
+                    # Names repeat on every row of an org/building; intern so buffered tuples share one string
+                    org_name = sys.intern(r[i_org].strip())
+                    bld_name = sys.intern(r[i_bld].strip())
+                    acct_name = sys.intern(r[i_acct].strip()) if i_acct is not None else ""
+                    identifier = r[i_ident].strip()
+                    external_id = r[i_ext].strip() if i_ext is not None else ""
+                    meter_type = r[i_type].strip().lower()
+                    parent_identifier = r[i_parent].strip() if i_parent is not None else ""
+                    unit = r[i_unit].strip()
+                    is_active_raw = r[i_active].strip() if i_active is not None else ""
+                    is_active = is_active_raw.lower() in TRUTHY if is_active_raw else True
+
+                    org_names.add(org_name)
+                    bld_keys.add((org_name, bld_name))
+                    if acct_name:
+                        acct_keys.add((org_name, acct_name))
+
+                    # buffer meter (create in second pass so parents can be resolved)
+                    meter_buffer.append((
+                        org_name, bld_name, acct_name,
+                        identifier, external_id or None, meter_type, unit, is_active,
+                    ))
+
+                    if parent_identifier:
+                        parent_links[(org_name, identifier)] = parent_identifier
+
+            # Second pass (nothing to write on dry runs): resolve names, create meters, then wire parents
+            if not dry_run and meter_buffer:
+                # get/create organizations, buildings and accounts: one SELECT each, then bulk INSERT the missing rows
+                orgs = dict(Organization.objects.filter(name__in=org_names).values_list("name", "id"))
+                new_orgs = [Organization(name=n) for n in org_names if n not in orgs]
+                if new_orgs:
+                    Organization.objects.bulk_create(new_orgs, batch_size=BATCH_SIZE, ignore_conflicts=True)
+                    created_counts["org"] += len(new_orgs)
+                    orgs = dict(Organization.objects.filter(name__in=org_names).values_list("name", "id"))
+                org_ids = set(orgs.values())
+
+                def resolve_named(model, keys):
+                    """Map (org_name, name) -> id for `keys`, bulk-creating the `model` rows that don't exist yet."""
+                    def load():
+                        return {
+                            (org_id, name): pk
+                            for org_id, name, pk in model.objects.filter(org_id__in=org_ids).values_list("org_id", "name", "id")
+                        }
+                    found = load()
+                    missing = [model(org_id=orgs[o], name=n) for o, n in keys if (orgs[o], n) not in found]
+                    if missing:
+                        model.objects.bulk_create(missing, batch_size=BATCH_SIZE, ignore_conflicts=True)
+                        found = load()
+                    return {(o, n): found[(orgs[o], n)] for o, n in keys}, len(missing)
+
+                bld_ids, created_counts["building"] = resolve_named(Building, bld_keys)
+                acct_ids, created_counts["account"] = resolve_named(Account, acct_keys)
+
+                # create meters: one query for the identifiers that already exist, then INSERT the rest in batches
+                existing = set(Meter.objects.filter(org_id__in=org_ids).values_list("org_id", "identifier"))
+                new_meters = {}  # (org_id, identifier) -> Meter; first row wins like get_or_create
+                for org_name, bld_name, acct_name, identifier, external_id, meter_type, unit, is_active in meter_buffer:
+                    org_id = orgs[org_name]
+                    key = (org_id, identifier)
+                    if key in existing or key in new_meters:
+                        continue
+
+                    new_meters[key] = Meter(
+                        org_id=org_id,
+                        identifier=identifier,
+                        building_id=bld_ids[(org_name, bld_name)],
+                        account_id=acct_ids[(org_name, acct_name)] if acct_name else None,
+                        external_id=external_id,
+                        meter_type=meter_type,
+                        unit=unit,
+                        is_active=is_active,
+                    )
+
+                if use_copy and new_meters:
+                    # Keys already in the table were filtered out above, so no conflict handling needed
+                    with connection.cursor() as cursor:
+                        copy_rows(
+                            cursor,
+                            Meter._meta.db_table,
+                            ["org_id", "building_id", "account_id", "identifier", "external_id",
+                             "meter_type", "unit", "is_active"],
+                            ((m.org_id, m.building_id, m.account_id, m.identifier, m.external_id,
+                              m.meter_type, m.unit, m.is_active) for m in new_meters.values()),
+                        )
+                else:
+                    # ignore_conflicts guards against a concurrent load inserting the same meter
+                    Meter.objects.bulk_create(new_meters.values(), batch_size=BATCH_SIZE, ignore_conflicts=True)
+                created_counts["meter"] += len(new_meters)
+
+                # wire parents: resolve both ends from one (org_id, identifier) -> (id, parent_id) map, then bulk UPDATE
+                if parent_links:
+                    meter_ids = {
+                        (org_id, ident): (pk, parent_id)
+                        for org_id, ident, pk, parent_id in Meter.objects.filter(org_id__in=org_ids)
+                        .values_list("org_id", "identifier", "id", "parent_id")
+                    }
+                    reparented = []
+                    for (org_name, child_ident), parent_ident in parent_links.items():
+                        org_id = orgs[org_name]
+                        child = meter_ids.get((org_id, child_ident))
+                        parent = meter_ids.get((org_id, parent_ident))
+                        if child is None or parent is None:
+                            missing = child_ident if child is None else parent_ident
+                            raise CommandError(f"Meter {missing!r} not found in org {org_name!r} while wiring parents.")
+                        if child[1] != parent[0]:
+                            reparented.append(Meter(id=child[0], parent_id=parent[0]))
+                    Meter.objects.bulk_update(reparented, ["parent"], batch_size=BATCH_SIZE)
 
         # Summary
         self.stdout.write(self.style.SUCCESS(f"Processed {row_count} rows. Created: "
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.6 on 2026-10-15 09:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0003_meter_api_meter_externa_e3e29d_idx"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="reading",
+            name="source",
+            field=models.CharField(
+                choices=[
+                    ("API", "API"),
+                    ("CSV", "CSV"),
+                    ("Manual", "Manual"),
+                    ("System", "System"),
+                ],
+                default="CSV",
+                max_length=10,
+            ),
+        ),
+        migrations.AlterUniqueTogether(
+            name="reading",
+            unique_together={("meter", "ts", "kind")},
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.6 on 2026-10-15 09:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0004_reading_source_system_unique_kind"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="reading",
+            index=models.Index(
+                fields=["meter", "kind", "ts"],
+                include=["value", "unit"],
+                name="api_reading_meter_kind_ts_idx",
+            ),
+        ),
+    ]
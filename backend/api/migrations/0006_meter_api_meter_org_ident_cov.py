@@ -0,0 +1,21 @@
+# Generated by Django 5.2.6 on 2026-10-15 10:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_reading_api_reading_meter_kind_ts_idx'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='meter',
+            name='api_meter_org_id_81ebd0_idx',
+        ),
+        migrations.AddIndex(
+            model_name='meter',
+            index=models.Index(fields=['org', 'identifier'], include=['id', 'parent'], name='api_meter_org_ident_cov'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.6 on 2026-10-15 14:20
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_meter_api_meter_org_ident_cov'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='reading',
+            name='api_reading_meter_i_f4b81b_idx',
+        ),
+    ]
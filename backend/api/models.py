@@ -88,7 +88,8 @@ class Meter(models.Model):
     class Meta:
         unique_together = ("org", "identifier")
         indexes = [
-            models.Index(fields=["org", "identifier"]),
+            # Covering index: (org, identifier) -> id/parent lookups (hierarchy parent wiring) are index-only
+            models.Index(fields=["org", "identifier"], include=["id", "parent"], name="api_meter_org_ident_cov"),
             models.Index(fields=["building"]),
             models.Index(fields=["account"]),
             models.Index(fields=["meter_type"]),
@@ -155,7 +156,8 @@ class Formula(models.Model):
 class Reading(models.Model):
     """
     Time series values for a meter.
-    - unique_together (meter, ts) -> ensures you don’t double-ingest the same timestamp for a meter.
+    - unique_together (meter, ts, kind) -> ensures you don’t double-ingest the same timestamp for a meter,
+      while letting a derived Consumption interval sit alongside the Accumulated read at the same ts.
     - classification/kind/source -> provenance + semantics.
     """
     class Classification(models.TextChoices):
@@ -168,6 +170,7 @@ class Reading(models.Model):
         API = "API", "API"
         CSV = "CSV", "CSV"
         MANUAL = "Manual", "Manual"
+        SYSTEM = "System", "System"  # derived by management commands (e.g. consumption)
 
     class Kind(models.TextChoices):
         ACCUMULATED = "Accumulated", "Accumulated"  # cumulative register (e.g., kWh totalizer)
@@ -183,9 +186,12 @@ class Reading(models.Model):
     kind = models.CharField(max_length=12, choices=Kind.choices, default=Kind.CONSUMPTION)
 
     class Meta:
-        unique_together = ("meter", "ts")
+        unique_together = ("meter", "ts", "kind")  # natural upsert key
+        # (meter, ts) lookups use the unique (meter, ts, kind) index's prefix
         indexes = [
-            models.Index(fields=["meter", "ts"]),
+            # Covering index for per-meter, per-kind time scans (compute_register_consumption)
+            models.Index(fields=["meter", "kind", "ts"], include=["value", "unit"],
+                         name="api_reading_meter_kind_ts_idx"),
         ]
 
     def __str__(self):
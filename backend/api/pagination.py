@@ -0,0 +1,16 @@
+from rest_framework.pagination import CursorPagination
+
+"""
+Default pagination for the UELogic API.
+
+Purpose:
+- Bounds list payloads (readings in particular can run to millions of rows).
+- Cursor pagination seeks on the primary key, so deep pages cost the same as the first
+  (no OFFSET scans) and no COUNT(*) is ever issued.
+"""
+
+class IdCursorPagination(CursorPagination):
+    ordering = "-id"  # models have no created timestamp; pk order is insertion order
+    page_size = 100
+    page_size_query_param = "page_size"
+    max_page_size = 1000
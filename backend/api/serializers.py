@@ -8,7 +8,8 @@ Purpose:
 - Maps Django ORM models (Organization, Building, Account, Meter,
   VirtualAllocation, Reading) to JSON for API responses.
 - Handles request payload validation and deserialization into ORM objects.
-- Uses ModelSerializer for simplicity, exposing all fields by default.
+- Uses ModelSerializer with explicit field lists, so the API shape doesn't change
+  silently when a model gains a column.
 
 These serializers are consumed by the viewsets in views.py to translate
 between Python objects and REST API input/output.
@@ -17,29 +18,30 @@ between Python objects and REST API input/output.
 class OrganizationSerializer(serializers.ModelSerializer):
     class Meta:
         model = Organization
-        fields = "__all__"
+        fields = ("id", "name")
 
 class BuildingSerializer(serializers.ModelSerializer):
     class Meta:
         model = Building
-        fields = "__all__"
+        fields = ("id", "org", "name")
 
 class AccountSerializer(serializers.ModelSerializer):
     class Meta:
         model = Account
-        fields = "__all__"
+        fields = ("id", "org", "name")
 
 class MeterSerializer(serializers.ModelSerializer):
     class Meta:
         model = Meter
-        fields = "__all__"
+        fields = ("id", "org", "building", "account", "identifier", "external_id",
+                  "meter_type", "parent", "unit", "is_active")
 
 class VirtualAllocationSerializer(serializers.ModelSerializer):
     class Meta:
         model = VirtualAllocation
-        fields = "__all__"
+        fields = ("id", "parent", "child", "percent")
 
 class ReadingSerializer(serializers.ModelSerializer):
     class Meta:
         model = Reading
-        fields = "__all__"
+        fields = ("id", "meter", "ts", "value", "unit", "classification", "source", "kind")
@@ -1,7 +1,377 @@
+import tempfile
+from datetime import datetime, timezone as dt_timezone
+from decimal import Decimal
+from io import StringIO
+from pathlib import Path
+from unittest import skipIf, skipUnless
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
 from django.test import TestCase
+from django.urls import reverse
+from rest_framework.test import APITestCase
+
+from .models import Organization, Building, Account, Meter, VirtualAllocation, Formula, Reading
+
+# The --use-copy paths stream through COPY FROM STDIN, which only PostgreSQL has
+IS_POSTGRES = connection.vendor == "postgresql"
+
 
 class SmokeTests(TestCase):
     def test_health(self):
-        from django.urls import reverse
         resp = self.client.get(reverse("health"))
         self.assertEqual(resp.status_code, 200)
+
+
+class CommandTestCase(TestCase):
+    """Runs management commands against small CSVs written to a temp directory."""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = Path(tmp.name)
+
+    def write_csv(self, name, text):
+        path = self.tmp / name
+        path.write_text(text, encoding="utf-8")
+        return str(path)
+
+    def run_command(self, *args, **opts):
+        out = StringIO()
+        call_command(*args, stdout=out, **opts)
+        return out.getvalue()
+
+
+class LoadHierarchyTests(CommandTestCase):
+    HEADER = "org,building,account,identifier,external_id,meter_type,parent_identifier,unit,is_active\n"
+
+    def hierarchy_csv(self, m3_parent="M1"):
+        return self.write_csv("hierarchy.csv", self.HEADER + (
+            "Acme,HQ,,M1,SER1,fiscal,,kWh,true\n"
+            "Acme,HQ,Tenant A,M2,,sub,M1,kWh,\n"
+            f"Acme,HQ,Tenant A,M3,,sub,{m3_parent},kWh,no\n"
+        ))
+
+    def parents(self):
+        by_id = dict(Meter.objects.values_list("id", "identifier"))
+        return {ident: by_id.get(parent_id) for ident, parent_id in Meter.objects.values_list("identifier", "parent_id")}
+
+    def test_load_creates_hierarchy(self):
+        out = self.run_command("load_hierarchy", self.hierarchy_csv())
+
+        self.assertIn("Processed 3 rows. Created: 1 orgs, 1 buildings, 1 accounts, 3 meters.", out)
+        meters = {m.identifier: m for m in Meter.objects.select_related("account")}
+        self.assertEqual(meters["M1"].external_id, "SER1")
+        self.assertIsNone(meters["M1"].account)
+        self.assertEqual(meters["M2"].account.name, "Tenant A")
+        self.assertTrue(meters["M2"].is_active)  # blank defaults to active
+        self.assertFalse(meters["M3"].is_active)
+
+    def test_rerun_is_idempotent(self):
+        path = self.hierarchy_csv()
+        self.run_command("load_hierarchy", path)
+        out = self.run_command("load_hierarchy", path)
+
+        self.assertIn("Created: 0 orgs, 0 buildings, 0 accounts, 0 meters.", out)
+        self.assertEqual(Organization.objects.count(), 1)
+        self.assertEqual(Building.objects.count(), 1)
+        self.assertEqual(Account.objects.count(), 1)
+        self.assertEqual(Meter.objects.count(), 3)
+
+    @skipUnless(IS_POSTGRES, "COPY is PostgreSQL-only")
+    def test_use_copy_inserts_new_meters(self):
+        out = self.run_command("load_hierarchy", self.hierarchy_csv(), use_copy=True)
+
+        self.assertIn("Created: 1 orgs, 1 buildings, 1 accounts, 3 meters.", out)
+        self.assertEqual(self.parents(), {"M1": None, "M2": "M1", "M3": "M1"})
+        m1 = Meter.objects.get(identifier="M1")
+        self.assertEqual((m1.external_id, m1.meter_type, m1.unit, m1.is_active), ("SER1", "fiscal", "kWh", True))
+        self.assertIsNone(Meter.objects.get(identifier="M2").external_id)
+
+        out = self.run_command("load_hierarchy", self.hierarchy_csv(), use_copy=True)
+        self.assertIn("0 meters.", out)
+        self.assertEqual(Meter.objects.count(), 3)
+
+    def test_short_rows_read_as_empty_cells(self):
+        path = self.write_csv("hierarchy.csv", self.HEADER + "Acme,HQ,,M1,,fiscal,,kWh\n")
+        out = self.run_command("load_hierarchy", path)
+
+        self.assertIn("Processed 1 rows.", out)
+        self.assertTrue(Meter.objects.get(identifier="M1").is_active)
+
+    def test_rerun_rewires_reparented_meters(self):
+        self.run_command("load_hierarchy", self.hierarchy_csv())
+        self.assertEqual(self.parents(), {"M1": None, "M2": "M1", "M3": "M1"})
+
+        self.run_command("load_hierarchy", self.hierarchy_csv(m3_parent="M2"))
+        self.assertEqual(self.parents(), {"M1": None, "M2": "M1", "M3": "M2"})
+
+    def test_unknown_parent_is_an_error(self):
+        with self.assertRaisesMessage(CommandError, "Meter 'M9' not found in org 'Acme'"):
+            self.run_command("load_hierarchy", self.hierarchy_csv(m3_parent="M9"))
+        # The load runs in one transaction, so the failure leaves nothing behind
+        self.assertFalse(Organization.objects.exists())
+        self.assertFalse(Meter.objects.exists())
+
+    def test_dry_run_writes_nothing(self):
+        out = self.run_command("load_hierarchy", self.hierarchy_csv(), dry_run=True)
+
+        self.assertIn("Processed 3 rows.", out)
+        self.assertFalse(Organization.objects.exists())
+        self.assertFalse(Meter.objects.exists())
+
+
+class LoadAllocationsTests(CommandTestCase):
+    def setUp(self):
+        super().setUp()
+        org = Organization.objects.create(name="Acme")
+        bld = Building.objects.create(org=org, name="HQ")
+        for ident, kind in [("P", "fiscal"), ("C1", "sub"), ("C2", "sub")]:
+            Meter.objects.create(org=org, building=bld, identifier=ident, meter_type=kind, unit="kWh")
+
+    def test_counts_and_last_duplicate_wins(self):
+        path = self.write_csv("alloc.csv", "org,parent,child,percent\nAcme,P,C1,60\nAcme,P,C2,40%\nAcme,P,C1,70\n")
+        out = self.run_command("load_allocations", path)
+
+        self.assertIn("Processed 3 rows. Created: 2, Updated: 1.", out)
+        pcts = {va.child.identifier: va.percent for va in VirtualAllocation.objects.all()}
+        self.assertEqual(pcts, {"C1": Decimal("70.0000"), "C2": Decimal("40.0000")})
+
+        out = self.run_command("load_allocations", path)
+        self.assertIn("Created: 0, Updated: 3.", out)
+        self.assertEqual(VirtualAllocation.objects.count(), 2)
+
+    def test_duplicate_heading_uses_first_column(self):
+        path = self.write_csv("alloc.csv", "org,parent,child,percent,percent\nAcme,P,C1,10,bogus\n")
+        self.run_command("load_allocations", path)
+
+        self.assertEqual(VirtualAllocation.objects.get().percent, Decimal("10.0000"))
+
+    def test_short_rows_read_as_empty_cells(self):
+        path = self.write_csv("alloc.csv", "org,parent,child,percent,note\n\nAcme,P,C1,60\n")
+        out = self.run_command("load_allocations", path)
+
+        self.assertIn("Processed 1 rows. Created: 1, Updated: 0.", out)
+
+    def test_dry_run_writes_nothing(self):
+        path = self.write_csv("alloc.csv", "org,parent,child,percent\nAcme,P,C1,60\n")
+        self.run_command("load_allocations", path, dry_run=True, check_refs=True)
+
+        self.assertFalse(VirtualAllocation.objects.exists())
+
+    def test_dry_run_without_check_refs_skips_lookups(self):
+        path = self.write_csv("alloc.csv", "org,parent,child,percent\nNobody,X,Y,60\n")
+        with self.assertNumQueries(0):
+            out = self.run_command("load_allocations", path, dry_run=True)
+
+        self.assertIn("Processed 1 rows.", out)
+        with self.assertRaisesMessage(CommandError, "Organization not found: Nobody"):
+            self.run_command("load_allocations", path, dry_run=True, check_refs=True)
+
+    @skipUnless(IS_POSTGRES, "COPY is PostgreSQL-only")
+    def test_use_copy_upserts(self):
+        path = self.write_csv("alloc.csv", "org,parent,child,percent\nAcme,P,C1,60\nAcme,P,C2,40\nAcme,P,C1,70\n")
+        out = self.run_command("load_allocations", path, use_copy=True)
+
+        self.assertIn("Processed 3 rows. Created: 2, Updated: 1.", out)
+        pcts = {va.child.identifier: va.percent for va in VirtualAllocation.objects.all()}
+        self.assertEqual(pcts, {"C1": Decimal("70.0000"), "C2": Decimal("40.0000")})
+
+        path = self.write_csv("alloc.csv", "org,parent,child,percent\nAcme,P,C1,25\n")
+        out = self.run_command("load_allocations", path, use_copy=True)
+        self.assertIn("Created: 0, Updated: 1.", out)
+        self.assertEqual(VirtualAllocation.objects.get(child__identifier="C1").percent, Decimal("25.0000"))
+        self.assertEqual(VirtualAllocation.objects.count(), 2)
+
+    @skipIf(IS_POSTGRES, "COPY is available")
+    def test_use_copy_rejected_without_postgres(self):
+        path = self.write_csv("alloc.csv", "org,parent,child,percent\nAcme,P,C1,60\n")
+        with self.assertRaisesMessage(CommandError, "--use-copy requires PostgreSQL."):
+            self.run_command("load_allocations", path, use_copy=True)
+
+
+class LoadFormulasTests(CommandTestCase):
+    CSV = (
+        "kind,identifier,expression,start,end\n"
+        "virtual,V1,A+B,2025-01-01T00:00:00Z,2025-02-01T00:00:00Z\n"
+        "virtual,V1,A-B,2025-01-01T00:00:00Z,2025-02-01T00:00:00Z\n"
+        "virtual,V1,A,2025-02-01T00:00:00Z,\n"
+    )
+
+    def setUp(self):
+        super().setUp()
+        org = Organization.objects.create(name="Acme")
+        bld = Building.objects.create(org=org, name="HQ")
+        self.target = Meter.objects.create(org=org, building=bld, identifier="V1",
+                                           meter_type=Meter.MeterType.VIRTUAL, unit="kWh")
+
+    def test_counts_and_last_duplicate_wins(self):
+        out = self.run_command("load_formulas", self.write_csv("formulas.csv", self.CSV))
+
+        self.assertIn("Processed 3 rows. Created: 2, Updated: 1.", out)
+        jan = datetime(2025, 1, 1, tzinfo=dt_timezone.utc)
+        self.assertEqual(Formula.objects.get(target_meter=self.target, start=jan).expression, "A-B")
+        self.assertIsNone(Formula.objects.get(expression="A").end)
+
+    def test_rerun_updates_in_place(self):
+        path = self.write_csv("formulas.csv", self.CSV)
+        self.run_command("load_formulas", path)
+        ids = set(Formula.objects.values_list("id", flat=True))
+
+        out = self.run_command("load_formulas", path)
+        self.assertIn("Created: 0, Updated: 3.", out)
+        self.assertEqual(set(Formula.objects.values_list("id", flat=True)), ids)
+
+    def test_replace_deletes_and_reinserts_matches(self):
+        path = self.write_csv("formulas.csv", self.CSV)
+        self.run_command("load_formulas", path)
+        ids = set(Formula.objects.values_list("id", flat=True))
+
+        out = self.run_command("load_formulas", path, replace=True)
+        self.assertIn("Created: 0, Updated: 3.", out)
+        self.assertEqual(Formula.objects.count(), 2)
+        self.assertTrue(ids.isdisjoint(Formula.objects.values_list("id", flat=True)))
+
+    def test_dry_run_writes_nothing(self):
+        path = self.write_csv("formulas.csv", self.CSV)
+        self.run_command("load_formulas", path, dry_run=True, check_refs=True)
+
+        self.assertFalse(Formula.objects.exists())
+
+    def test_dry_run_without_check_refs_skips_lookups(self):
+        path = self.write_csv("formulas.csv", "kind,identifier,expression,start\nvirtual,NOPE,A,2025-01-01T00:00:00Z\n")
+        with self.assertNumQueries(0):
+            self.run_command("load_formulas", path, dry_run=True)
+
+        with self.assertRaises(CommandError):
+            self.run_command("load_formulas", path, dry_run=True, check_refs=True)
+
+    @skipUnless(IS_POSTGRES, "COPY is PostgreSQL-only")
+    def test_use_copy_inserts_new_and_replaced_rows(self):
+        path = self.write_csv("formulas.csv", self.CSV)
+        out = self.run_command("load_formulas", path, use_copy=True)
+
+        self.assertIn("Created: 2, Updated: 1.", out)
+        jan = datetime(2025, 1, 1, tzinfo=dt_timezone.utc)
+        self.assertEqual(Formula.objects.get(start=jan, end=datetime(2025, 2, 1, tzinfo=dt_timezone.utc)).expression, "A-B")
+        self.assertIsNone(Formula.objects.get(expression="A").end)
+        ids = set(Formula.objects.values_list("id", flat=True))
+
+        out = self.run_command("load_formulas", path, use_copy=True, replace=True)
+        self.assertIn("Created: 0, Updated: 3.", out)
+        self.assertEqual(Formula.objects.count(), 2)
+        self.assertTrue(ids.isdisjoint(Formula.objects.values_list("id", flat=True)))
+
+    def test_row_numbers_count_records_not_lines(self):
+        path = self.write_csv("formulas.csv", (
+            "kind,identifier,expression,start,end\n"
+            'virtual,V1,"A\n+B",2025-01-01T00:00:00Z,\n'
+            "virtual,V1,A,not-a-date,\n"
+        ))
+        with self.assertRaisesMessage(CommandError, "Row 3: could not parse datetime"):
+            self.run_command("load_formulas", path, dry_run=True)
+        self.assertFalse(Formula.objects.exists())
+
+
+class ComputeRegisterConsumptionTests(CommandTestCase):
+    def setUp(self):
+        super().setUp()
+        self.org = Organization.objects.create(name="Acme")
+        self.bld = Building.objects.create(org=self.org, name="HQ")
+        self.meter = self.sub_meter("S1", self.bld, ["100", "150", "140", "160"])
+
+    def sub_meter(self, identifier, building, values, **extra):
+        meter = Meter.objects.create(org=self.org, building=building, identifier=identifier,
+                                     meter_type=Meter.MeterType.SUB, unit="kWh", **extra)
+        for day, value in enumerate(values, start=1):
+            Reading.objects.create(meter=meter, ts=datetime(2025, 1, day, tzinfo=dt_timezone.utc),
+                                   value=Decimal(value), unit="kWh", kind=Reading.Kind.ACCUMULATED)
+        return meter
+
+    def consumption(self, meter):
+        return list(Reading.objects.filter(meter=meter, kind=Reading.Kind.CONSUMPTION)
+                    .order_by("ts").values_list("ts__day", "value", "source", "classification"))
+
+    def test_deltas_skip_negative_and_rerun_is_stable(self):
+        out = self.run_command("compute_register_consumption")
+
+        self.assertIn("Wrote/updated 2 consumption intervals.", out)
+        expected = [
+            (2, Decimal("50"), Reading.Source.SYSTEM, Reading.Classification.SYSTEM),
+            (4, Decimal("20"), Reading.Source.SYSTEM, Reading.Classification.SYSTEM),
+        ]
+        self.assertEqual(self.consumption(self.meter), expected)
+
+        self.run_command("compute_register_consumption")
+        self.assertEqual(self.consumption(self.meter), expected)
+        self.assertEqual(Reading.objects.count(), 6)
+
+    def test_only_active_sub_meters_in_site(self):
+        annex = Building.objects.create(org=self.org, name="Annex")
+        other = self.sub_meter("S2", annex, ["10", "30"])
+        inactive = self.sub_meter("S3", self.bld, ["10", "30"], is_active=False)
+        out = self.run_command("compute_register_consumption", site="HQ")
+
+        self.assertIn("Wrote/updated 2 consumption intervals.", out)
+        self.assertEqual(self.consumption(other), [])
+        self.assertEqual(self.consumption(inactive), [])
+
+        out = self.run_command("compute_register_consumption", site="Nowhere")
+        self.assertIn("No sub meters to process.", out)
+
+
+class ApiTests(APITestCase):
+    def setUp(self):
+        user = get_user_model().objects.create_user(username="tester", password="pw")
+        self.client.force_authenticate(user)
+        self.org = Organization.objects.create(name="Acme")
+        self.bld = Building.objects.create(org=self.org, name="HQ")
+        Building.objects.create(org=self.org, name="Annex")
+        self.m1 = Meter.objects.create(org=self.org, building=self.bld, identifier="M1", unit="kWh")
+        self.m2 = Meter.objects.create(org=self.org, building=self.bld, identifier="M2", unit="kWh")
+
+    def list_ids(self, url_name, **params):
+        resp = self.client.get(reverse(url_name), params)
+        self.assertEqual(resp.status_code, 200)
+        return {row["id"] for row in resp.data["results"]}
+
+    def test_filters_narrow_results(self):
+        ts = datetime(2025, 1, 2, tzinfo=dt_timezone.utc)
+        consumption = Reading.objects.create(meter=self.m1, ts=ts, value=Decimal("5"), unit="kWh",
+                                             kind=Reading.Kind.CONSUMPTION)
+        Reading.objects.create(meter=self.m1, ts=ts, value=Decimal("105"), unit="kWh",
+                               kind=Reading.Kind.ACCUMULATED)
+        Reading.objects.create(meter=self.m2, ts=ts, value=Decimal("7"), unit="kWh",
+                               kind=Reading.Kind.CONSUMPTION)
+
+        self.assertEqual(self.list_ids("reading-list", meter=self.m1.id, kind="Consumption"), {consumption.id})
+        self.assertEqual(self.list_ids("meter-list", org=self.org.id, identifier="M1"), {self.m1.id})
+        self.assertEqual(self.list_ids("meter-list", identifier="M2"), {self.m2.id})
+        self.assertEqual(self.list_ids("building-list", org=self.org.id, name="HQ"), {self.bld.id})
+
+    def test_list_is_cursor_paginated(self):
+        for i in range(3, 6):
+            Meter.objects.create(org=self.org, building=self.bld, identifier=f"M{i}", unit="kWh")
+        resp = self.client.get(reverse("meter-list"), {"page_size": 2})
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(set(resp.data), {"next", "previous", "results"})
+        self.assertIsNone(resp.data["previous"])
+        self.assertIn("cursor=", resp.data["next"])
+        first = [m["identifier"] for m in resp.data["results"]]
+        self.assertEqual(first, ["M5", "M4"])  # newest first
+
+        resp = self.client.get(resp.data["next"])
+        self.assertEqual([m["identifier"] for m in resp.data["results"]], ["M3", "M2"])
+
+    def test_organizations_and_buildings_are_read_only(self):
+        resp = self.client.post(reverse("organization-list"), {"name": "Other"}, format="json")
+        self.assertEqual(resp.status_code, 405)
+        resp = self.client.delete(reverse("building-detail", args=[self.bld.id]))
+        self.assertEqual(resp.status_code, 405)
+
+        self.assertEqual(Organization.objects.count(), 1)
+        self.assertTrue(Building.objects.filter(id=self.bld.id).exists())
+        self.assertEqual(self.list_ids("organization-list"), {self.org.id})
@@ -1,6 +1,5 @@
-from rest_framework.decorators import api_view, permission_classes
-from rest_framework.permissions import AllowAny
-from rest_framework.response import Response
+from django.http import HttpResponse
+from django.views.decorators.http import require_safe
 from rest_framework import viewsets
 from django_filters.rest_framework import DjangoFilterBackend
 
@@ -9,52 +8,69 @@ from .serializers import (
     OrganizationSerializer, BuildingSerializer, AccountSerializer,
     MeterSerializer, VirtualAllocationSerializer, ReadingSerializer
 )
+from .filters import (
+    OrganizationFilter, BuildingFilter, AccountFilter,
+    MeterFilter, VirtualAllocationFilter, ReadingFilter
+)
 
 
 """
 Django REST Framework (DRF) view layer for UELogic.
 
 Purpose:
-- Exposes CRUD APIs for core domain models: Organization, Building, Account, Meter,
-  VirtualAllocation, and Reading.
-- Provides a reusable BaseViewSet with filtering enabled for all models.
-- Defines the /health endpoint for quick liveness checks.
+- Exposes CRUD APIs for core domain models: Account, Meter, VirtualAllocation, and Reading.
+- Exposes Organization and Building read-only; they change rarely and are written by
+  load_hierarchy or staff via the Django admin.
+- Provides a reusable BaseViewSet with filtering enabled; each viewset whitelists
+  its filterable (indexed) columns via a FilterSet in filters.py.
+- Defines the /health endpoint for quick liveness checks (a plain Django view, no DRF).
 - Handles serialization ↔ database mapping via corresponding serializers.
 
 This is the main entry point for the REST API, consumed by the React frontend
 and other integrations (e.g., ingestion scripts).
 """
 
-@api_view(["GET"])
-@permission_classes([AllowAny])
+# Precomputed liveness payload; /health is polled constantly, so it skips DRF entirely
+HEALTH_BODY = b'{"status": "ok"}'
+
+@require_safe
 def health(request):
-    return Response({"status": "ok"})
+    return HttpResponse(HEALTH_BODY, content_type="application/json")
 
 # Base viewset with filters enabled
 class BaseViewSet(viewsets.ModelViewSet):
     filter_backends = [DjangoFilterBackend]
-    filterset_fields = "__all__"
 
-class OrganizationViewSet(BaseViewSet):
+# Read-only variant for lookup tables that are maintained by the loaders / Django admin
+class BaseReadOnlyViewSet(viewsets.ReadOnlyModelViewSet):
+    filter_backends = [DjangoFilterBackend]
+
+class OrganizationViewSet(BaseReadOnlyViewSet):
     queryset = Organization.objects.all()
     serializer_class = OrganizationSerializer
+    filterset_class = OrganizationFilter
 
-class BuildingViewSet(BaseViewSet):
+class BuildingViewSet(BaseReadOnlyViewSet):
     queryset = Building.objects.all()
     serializer_class = BuildingSerializer
+    filterset_class = BuildingFilter
 
 class AccountViewSet(BaseViewSet):
     queryset = Account.objects.all()
     serializer_class = AccountSerializer
+    filterset_class = AccountFilter
 
 class MeterViewSet(BaseViewSet):
     queryset = Meter.objects.all()
     serializer_class = MeterSerializer
+    filterset_class = MeterFilter
 
 class VirtualAllocationViewSet(BaseViewSet):
     queryset = VirtualAllocation.objects.all()
     serializer_class = VirtualAllocationSerializer
+    filterset_class = VirtualAllocationFilter
 
 class ReadingViewSet(BaseViewSet):
     queryset = Reading.objects.all()
-    serializer_class = ReadingSerializer
\ No newline at end of file
+    serializer_class = ReadingSerializer
+    filterset_class = ReadingFilter
\ No newline at end of file
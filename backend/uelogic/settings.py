@@ -6,7 +6,10 @@ from datetime import timedelta
 BASE_DIR = Path(__file__).resolve().parent.parent
 SECRET_KEY = os.environ.get("DJANGO_SECRET_KEY", "dev-secret-key")
 DEBUG = os.environ.get("DJANGO_DEBUG", "True") == "True"
-ALLOWED_HOSTS = os.environ.get("DJANGO_ALLOWED_HOSTS", "localhost,127.0.0.1").split(",")
+# Canonicalised (stripped, lowercased, de-duplicated) so "a.com, A.com" style env values match
+ALLOWED_HOSTS = list(dict.fromkeys(
+    h.strip().lower() for h in os.environ.get("DJANGO_ALLOWED_HOSTS", "localhost,127.0.0.1").split(",") if h.strip()
+))
 
 # --- Apps ---
 INSTALLED_APPS = [
@@ -29,6 +32,7 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     "django.middleware.security.SecurityMiddleware",
     "whitenoise.middleware.WhiteNoiseMiddleware",        # WhiteNoise early
+    "django.middleware.gzip.GZipMiddleware",             # compress API/admin responses; static files are pre-compressed by WhiteNoise
     "django.contrib.sessions.middleware.SessionMiddleware",
     "corsheaders.middleware.CorsMiddleware",             # before CommonMiddleware
     "django.middleware.common.CommonMiddleware",
@@ -68,6 +72,13 @@ DATABASES = {
         "PASSWORD": os.environ.get("POSTGRES_PASSWORD", "uelogic"),
         "HOST": os.environ.get("POSTGRES_HOST", "db"),
         "PORT": os.environ.get("POSTGRES_PORT", "5432"),
+        # Persistent connections: reuse one connection per worker instead of reconnecting per request
+        "CONN_MAX_AGE": int(os.environ.get("POSTGRES_CONN_MAX_AGE", "600")),
+        "CONN_HEALTH_CHECKS": True,  # drop a stale persistent connection before it's reused
+        "OPTIONS": {
+            "application_name": "uelogic",
+            "sslmode": os.environ.get("POSTGRES_SSLMODE", "prefer"),  # set to "require" for managed Postgres
+        },
     }
 }
 
@@ -79,6 +90,9 @@ REST_FRAMEWORK = {
     "DEFAULT_PERMISSION_CLASSES": (
         "rest_framework.permissions.IsAuthenticated",
     ),
+    # Bounded list responses; keyset (cursor) pages avoid OFFSET scans and COUNT(*).
+    # Page size lives on the class (api/pagination.py).
+    "DEFAULT_PAGINATION_CLASS": "api.pagination.IdCursorPagination",
 }
 
 SIMPLE_JWT = {
@@ -108,8 +122,11 @@ STATIC_ROOT = BASE_DIR / "staticfiles"
 MEDIA_URL = "/media/"
 MEDIA_ROOT = BASE_DIR / "media"
 
-# WhiteNoise storage (note the class name spelling)
-STATICFILES_STORAGE = "whitenoise.storage.CompressedManifestStaticFilesStorage"
+# WhiteNoise storage (note the class name spelling); STORAGES replaces STATICFILES_STORAGE, removed in Django 5.1
+STORAGES = {
+    "default": {"BACKEND": "django.core.files.storage.FileSystemStorage"},
+    "staticfiles": {"BACKEND": "whitenoise.storage.CompressedManifestStaticFilesStorage"},
+}
 
 # --- CORS (explicit origins for local FE) ---
 CORS_ALLOWED_ORIGINS = [
@@ -133,3 +150,7 @@ if not DEBUG:
     SECURE_CONTENT_TYPE_NOSNIFF = True
     SESSION_COOKIE_SECURE = True
     CSRF_COOKIE_SECURE = True
+    # JSON only in production: skips the browsable API's template rendering and form building
+    REST_FRAMEWORK["DEFAULT_RENDERER_CLASSES"] = (
+        "rest_framework.renderers.JSONRenderer",
+    )
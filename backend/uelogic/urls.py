@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.urls import path, include
 from django.contrib import admin
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
@@ -7,5 +8,8 @@ urlpatterns = [
     path("api/auth/jwt/refresh", TokenRefreshView.as_view(), name="jwt-refresh"),
     path("admin/", admin.site.urls),
     path("api/", include("api.urls")),  # your DRF routes
-    path("api-auth/", include("rest_framework.urls"))  # enables Login in browsable API
-]
\ No newline at end of file
+]
+
+if settings.DEBUG:
+    # Browsable-API session login; production serves JSON only (JWT), so it's dev-only
+    urlpatterns.append(path("api-auth/", include("rest_framework.urls")))
\ No newline at end of file